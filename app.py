@@ -1,151 +1,236 @@
-from flask import Flask, request, jsonify
+from fastapi import APIRouter, FastAPI, Request, Response
+from fastapi.responses import HTMLResponse, ORJSONResponse, PlainTextResponse
 import logging
+import hmac
+import orjson
 import os
 import threading
+import time
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Use uvloop for the event loop when available (Linux); it has much lower
+# scheduling overhead than the default selector loop
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
+
+# Configure logging (skip when a parent process already configured it)
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Deployment-time endpoints live on their own router so the hot-path
+# routing table stays minimal (/, /health, /webhook)
+admin = APIRouter(prefix='/admin')
 
 # Bot components
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET_TOKEN = os.environ.get('WEBHOOK_SECRET_TOKEN', '')
+UPDATE_QUEUE_MAXSIZE = int(os.environ.get('UPDATE_QUEUE_MAXSIZE', '1000'))
+
+# Precomputed once; handlers only reference the constant
+WEBHOOK_ENDPOINT = f"{WEBHOOK_URL}/webhook" if WEBHOOK_URL else None
+
+# Static portion of the /health payload, built once; probes only pay for
+# the uptime field (monotonic clock is a vDSO read, not a full syscall)
+_STARTUP_MONO = time.monotonic()
+_HEALTH_STATIC = {
+    "status": "healthy",
+    "service": "telegram-bot",
+    "webhook_url": WEBHOOK_URL
+}
+
+# Short-lived cache for /get_webhook_info so dashboard/probe polling
+# doesn't hit Telegram on every request
+WEBHOOK_INFO_TTL = 5.0
+_webhook_info_cache = (None, 0.0)
+
+# Bot state, populated lazily by _init_bot()
+application = None
+Update = None
+_enqueue_update = None
+_queue_size = None
+_init_lock = threading.Lock()
+
+def _init_bot():
+    """Import the bot exactly once; safe under concurrent calls"""
+    global application, Update, _enqueue_update, _queue_size
+
+    with _init_lock:
+        if application is not None:
+            return True
+
+        try:
+            import bot
+            from telegram import Update as _Update
+        except Exception as e:
+            logger.error("❌ Failed to import bot: %s", e)
+            return False
+
+        Update = _Update
+
+        # Pre-bound queue methods so the hot path skips the attribute walks;
+        # the queue is drained by the application on the serving loop itself
+        _enqueue_update = bot.application.update_queue.put_nowait
+        _queue_size = bot.application.update_queue.qsize
+        application = bot.application
+        return True
+
+@app.on_event('startup')
+async def startup():
+    """Initialize the bot after the server socket is bound"""
+    if not _init_bot():
+        return
+
+    # Start update processing on the serving loop. post_init must be
+    # invoked by hand here: PTB only calls it from its own run_* helpers
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
 
-# Import and setup bot
-try:
-    from bot import updater, dispatcher
-    
     # Set webhook on startup
-    if WEBHOOK_URL and BOT_TOKEN:
-        webhook_url = f"{WEBHOOK_URL}/webhook"
-        updater.bot.set_webhook(webhook_url)
-        logger.info(f"✅ Webhook set to: {webhook_url}")
+    if WEBHOOK_ENDPOINT and BOT_TOKEN:
+        await application.bot.set_webhook(
+            WEBHOOK_ENDPOINT,
+            secret_token=WEBHOOK_SECRET_TOKEN or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logger.info("✅ Webhook set to: %s", WEBHOOK_ENDPOINT)
     else:
         logger.warning("⚠️ WEBHOOK_URL or BOT_TOKEN not set, webhook not configured")
-        
-except Exception as e:
-    logger.error(f"❌ Failed to import bot: {e}")
-    updater = None
-    dispatcher = None
-
-@app.route('/')
-def home():
+
+@app.on_event('shutdown')
+async def shutdown():
+    """Stop update processing cleanly"""
+    if application is not None:
+        await application.stop()
+        await application.shutdown()
+
+@app.exception_handler(Exception)
+async def unhandled_exception(request: Request, exc: Exception):
+    """Single error handler so routes don't each carry a try/except"""
+    logger.exception("Unhandled error on %s", request.url.path)
+    return ORJSONResponse({"success": False, "error": str(exc)}, status_code=500)
+
+@app.get('/', response_class=HTMLResponse)
+async def home():
     return """
     <h1>🤖 Telegram Bot is Running!</h1>
     <p>Your bot is successfully deployed on Render.</p>
     <p>Endpoints:</p>
     <ul>
         <li><a href="/health">/health</a> - Health check</li>
-        <li><a href="/set_webhook">/set_webhook</a> - Set webhook</li>
-        <li><a href="/get_webhook_info">/get_webhook_info</a> - Check webhook status</li>
+        <li><a href="/admin/set_webhook">/admin/set_webhook</a> - Set webhook</li>
+        <li><a href="/admin/get_webhook_info">/admin/get_webhook_info</a> - Check webhook status</li>
     </ul>
     """
 
-@app.route('/health')
-def health():
-    status = {
-        "status": "healthy",
-        "service": "telegram-bot",
-        "bot_initialized": updater is not None,
-        "webhook_url": WEBHOOK_URL
+@app.get('/health')
+async def health():
+    return {
+        **_HEALTH_STATIC,
+        "bot_initialized": application is not None,
+        "uptime_s": int(time.monotonic() - _STARTUP_MONO)
     }
-    return jsonify(status)
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
+@app.post('/webhook')
+async def webhook(request: Request):
     """Handle incoming updates from Telegram"""
     try:
-        if updater is None:
-            logger.error("Bot updater not initialized")
-            return 'Bot not initialized', 500
-            
-        # Get the update from Telegram
-        update = request.get_json()
-        
-        # Process the update in a thread to avoid blocking
-        thread = threading.Thread(target=process_update, args=(update,))
-        thread.start()
-        
-        return 'ok'
-        
-    except Exception as e:
-        logger.error(f"Error in webhook handler: {e}")
-        return 'error', 500
-
-def process_update(update):
-    """Process update in a separate thread"""
-    try:
-        # Use the dispatcher to process the update
-        dispatcher.process_update(update)
-    except Exception as e:
-        logger.error(f"Error processing update: {e}")
+        if application is None:
+            logger.error("Bot application not initialized")
+            return PlainTextResponse('Bot not initialized', status_code=500)
 
-@app.route('/set_webhook', methods=['GET'])
-def set_webhook():
+        # Constant-time check of Telegram's secret-token header
+        if WEBHOOK_SECRET_TOKEN and not hmac.compare_digest(
+            request.headers.get('X-Telegram-Bot-Api-Secret-Token', ''),
+            WEBHOOK_SECRET_TOKEN
+        ):
+            return PlainTextResponse('unauthorized', status_code=401)
+
+        # Shed load when update processing falls behind; Telegram retries on 429
+        if _queue_size() >= UPDATE_QUEUE_MAXSIZE:
+            logger.warning("Update queue full, rejecting update")
+            return PlainTextResponse('queue full', status_code=429)
+
+        # Get the update from Telegram and hand it to the application's queue
+        data = orjson.loads(await request.body())
+        _enqueue_update(Update.de_json(data, application.bot))
+
+        # Telegram only checks for a 2xx; skip the response body entirely
+        return Response(status_code=204)
+
+    except Exception:
+        logger.exception("Error in webhook handler")
+        return PlainTextResponse('error', status_code=500)
+
+@admin.get('/set_webhook')
+async def set_webhook():
     """Set webhook endpoint"""
-    try:
-        if updater is None:
-            return jsonify({"success": False, "error": "Bot not initialized"})
-            
-        if not WEBHOOK_URL:
-            return jsonify({"success": False, "error": "WEBHOOK_URL not set"})
-            
-        webhook_url = f"{WEBHOOK_URL}/webhook"
-        result = updater.bot.set_webhook(webhook_url)
-        
-        logger.info(f"Webhook set to: {webhook_url}")
-        return jsonify({
-            "success": True,
-            "message": "Webhook set successfully",
-            "webhook_url": webhook_url,
-            "result": result
-        })
-        
-    except Exception as e:
-        logger.error(f"Error setting webhook: {e}")
-        return jsonify({"success": False, "error": str(e)})
-
-@app.route('/delete_webhook', methods=['GET'])
-def delete_webhook():
+    if application is None:
+        return {"success": False, "error": "Bot not initialized"}
+
+    if not WEBHOOK_ENDPOINT:
+        return {"success": False, "error": "WEBHOOK_URL not set"}
+
+    result = await application.bot.set_webhook(
+        WEBHOOK_ENDPOINT,
+        secret_token=WEBHOOK_SECRET_TOKEN or None,
+        allowed_updates=Update.ALL_TYPES
+    )
+
+    logger.info("Webhook set to: %s", WEBHOOK_ENDPOINT)
+    return {
+        "success": True,
+        "message": "Webhook set successfully",
+        "webhook_url": WEBHOOK_ENDPOINT,
+        "result": result
+    }
+
+@admin.get('/delete_webhook')
+async def delete_webhook():
     """Delete webhook endpoint"""
-    try:
-        if updater is None:
-            return jsonify({"success": False, "error": "Bot not initialized"})
-            
-        result = updater.bot.delete_webhook()
-        return jsonify({"success": True, "result": result})
-        
-    except Exception as e:
-        logger.error(f"Error deleting webhook: {e}")
-        return jsonify({"success": False, "error": str(e)})
-
-@app.route('/get_webhook_info', methods=['GET'])
-def get_webhook_info():
+    if application is None:
+        return {"success": False, "error": "Bot not initialized"}
+
+    result = await application.bot.delete_webhook()
+    return {"success": True, "result": result}
+
+@admin.get('/get_webhook_info')
+async def get_webhook_info():
     """Get current webhook info"""
-    try:
-        if updater is None:
-            return jsonify({"success": False, "error": "Bot not initialized"})
-            
-        info = updater.bot.get_webhook_info()
-        return jsonify({
-            "success": True,
-            "url": info.url,
-            "has_custom_certificate": info.has_custom_certificate,
-            "pending_update_count": info.pending_update_count,
-            "last_error_date": info.last_error_date,
-            "last_error_message": info.last_error_message
-        })
-        
-    except Exception as e:
-        logger.error(f"Error getting webhook info: {e}")
-        return jsonify({"success": False, "error": str(e)})
+    global _webhook_info_cache
+    if application is None:
+        return {"success": False, "error": "Bot not initialized"}
+
+    payload, expires_at = _webhook_info_cache
+    if payload is not None and time.monotonic() < expires_at:
+        return payload
+
+    info = await application.bot.get_webhook_info()
+    payload = {
+        "success": True,
+        "url": info.url,
+        "has_custom_certificate": info.has_custom_certificate,
+        "pending_update_count": info.pending_update_count,
+        "last_error_date": info.last_error_date,
+        "last_error_message": info.last_error_message
+    }
+    _webhook_info_cache = (payload, time.monotonic() + WEBHOOK_INFO_TTL)
+    return payload
+
+app.include_router(admin)
 
 if __name__ == '__main__':
+    import uvicorn
     port = int(os.environ.get('PORT', 5000))
-    logger.info(f"Starting Flask app on port {port}")
-    app.run(host='0.0.0.0', port=port, debug=False)
+    logger.info("Starting ASGI app on port %s", port)
+    uvicorn.run(app, host='0.0.0.0', port=port)
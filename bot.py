@@ -1,30 +1,92 @@
+import asyncio
 import os
 import logging
-import asyncio
+import logging.handlers
+import queue
+import string
+import time
 from datetime import datetime, timedelta
-from threading import Thread
 
-from telegram import Update, Chat, User
+import orjson
+
+from telegram import Update
+from telegram.error import NetworkError, RetryAfter, TelegramError
 from telegram.ext import (
-    Updater,
+    AIORateLimiter,
+    Application,
     CommandHandler,
     MessageHandler,
     ChatMemberHandler,
-    CallbackContext,
-    Filters
+    ContextTypes,
+    filters
 )
+from telegram.request import HTTPXRequest
+
+import storage
+
+# Use uvloop for the event loop when available (Linux); a no-op when
+# app.py, which installs it first, imported us
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    uvloop = None
+
+# The application builder below needs a resolvable event loop for the
+# JobQueue scheduler, and uvloop's policy refuses to auto-create one
+# outside async code — so when imported without a running loop (the
+# standalone polling path), set one up explicitly
+try:
+    asyncio.get_running_loop()
+except RuntimeError:
+    asyncio.set_event_loop(asyncio.new_event_loop())
+
+class ORJSONRequest(HTTPXRequest):
+    """HTTPXRequest that parses Bot API responses with orjson.
+
+    Every update fetched and every send_* response goes through
+    parse_json_payload; orjson decodes them several times faster than the
+    stdlib, which adds up across a broadcast's thousands of responses.
+    """
+
+    @staticmethod
+    def parse_json_payload(payload: bytes):
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError as exc:
+            raise TelegramError("Invalid server response") from exc
+
+# Configure logging. Records go onto a queue consumed by a background
+# listener thread, so the event loop never blocks on a stderr write even
+# when a broadcast emits thousands of lines at once. This replaces any
+# synchronous handler a parent process installed via basicConfig
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+_root_logger = logging.getLogger()
+_root_logger.handlers.clear()
+_root_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_root_logger.setLevel(logging.INFO)
+
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 # Configuration
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
-ADMIN_IDS = list(map(int, os.environ.get('ADMIN_IDS', '').split(','))) if os.environ.get('ADMIN_IDS') else []
+ADMIN_IDS = frozenset(map(int, os.environ.get('ADMIN_IDS', '').split(','))) if os.environ.get('ADMIN_IDS') else frozenset()
 BAN_DURATION_HOURS = 1
+BAN_DURATION_SECONDS = BAN_DURATION_HOURS * 3600
+BROADCAST_CONCURRENCY = 25  # below Telegram's ~30 msg/s bulk limit
+CONCURRENT_UPDATES = int(os.environ.get('CONCURRENT_UPDATES', '256'))
+# Sized to match CONCURRENT_UPDATES so parallel handlers and broadcast
+# fan-out never queue on a free connection; keep-alive keeps TLS warm
+CONNECTION_POOL_SIZE = int(os.environ.get('CONNECTION_POOL_SIZE', '256'))
+GET_UPDATES_POOL_SIZE = int(os.environ.get('GET_UPDATES_POOL_SIZE', '4'))
+MAX_TRACKED_JOINS = int(os.environ.get('MAX_TRACKED_JOINS', '100000'))
+POOL_TIMEOUT = float(os.environ.get('POOL_TIMEOUT', '10.0'))
 
 # Validate required environment variables
 if not BOT_TOKEN:
@@ -34,48 +96,32 @@ if not BOT_TOKEN:
 if not ADMIN_IDS:
     logger.warning("⚠️ ADMIN_IDS environment variable not set. Admin commands will not work.")
 
-# Storage
-user_join_times = {}
+# Storage. Join records and the active-chat list live in SQLite (see
+# storage.py) so they survive restarts and never outgrow RAM. active_chats
+# keeps an in-memory mirror, loaded once at startup, so broadcast fan-out
+# and /stats never touch the database. broadcast_data is a transient admin
+# session and stays memory-only
+storage.connect()
 broadcast_data = {}
 active_chats = set()
 
-# Create updater
-try:
-    updater = Updater(token=BOT_TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
-    logger.info("✅ Bot updater created successfully")
-except Exception as e:
-    logger.error(f"❌ Failed to create bot updater: {e}")
-    exit(1)
+# Who the collect handler listens to. Admin ids are added on /broadcast
+# and removed again when the broadcast is sent or cancelled, so outside
+# a collection session the filter tree rejects every message before the
+# handler body runs; while empty it matches nobody
+broadcast_collect_filter = filters.User()
 
-def start(update: Update, context: CallbackContext):
-    """Handle /start command"""
-    try:
-        user = update.effective_user
-        chat = update.effective_chat
-        
-        if chat:
-            active_chats.add(chat.id)
-            logger.info(f"Chat {chat.id} added to active chats")
-        
-        welcome_text = (
-            f"👋 Hello {user.first_name}!\n\n"
-            f"I'm a moderation bot that:\n"
-            f"• 🚫 Bans users who leave within {BAN_DURATION_HOURS} hour of joining\n"
-            f"• 📢 Supports broadcast messages\n\n"
-            f"Add me to your group/channel and make me admin to start moderating!\n\n"
-            f"Use /help to see all commands."
-        )
-        
-        update.message.reply_text(welcome_text)
-        logger.info(f"Start command from user {user.id} in chat {chat.id if chat else 'unknown'}")
-    except Exception as e:
-        logger.error(f"Error in start command: {e}")
+# Reply texts built once; only the /start greeting varies per user
+WELCOME_TEMPLATE = (
+    "👋 Hello {name}!\n\n"
+    "I'm a moderation bot that:\n"
+    f"• 🚫 Bans users who leave within {BAN_DURATION_HOURS} hour of joining\n"
+    "• 📢 Supports broadcast messages\n\n"
+    "Add me to your group/channel and make me admin to start moderating!\n\n"
+    "Use /help to see all commands."
+)
 
-def help_command(update: Update, context: CallbackContext):
-    """Handle /help command"""
-    try:
-        help_text = """
+HELP_TEXT = """
 🤖 Available Commands:
 
 For Everyone:
@@ -90,225 +136,365 @@ For Admins:
 
 📝 Note: Make sure I have admin permissions in your groups/channels for the auto-ban feature to work properly.
         """
-        update.message.reply_text(help_text)
+
+BROADCAST_INSTRUCTIONS = (
+    "📢 Broadcast Mode Started!\n\n"
+    "Now you can send me the messages you want to broadcast. I support:\n"
+    "• Text messages\n"
+    "• Photos with captions\n"
+    "• Videos with captions\n"
+    "• Documents with captions\n"
+    "• Stickers\n\n"
+    "Send your messages one by one. When you're done, use:\n"
+    "• /send_broadcast - To send all collected messages\n"
+    "• /cancel_broadcast - To cancel and clear all messages\n\n"
+    "Currently collected: 0 messages"
+)
+
+# Precompiled ban notice; substitute only fills the three variable fields
+BAN_TMPL = string.Template(
+    "🚫 User Banned\n\n"
+    "• User: @$user\n"
+    "• Joined: $joined\n"
+    "• Time in chat: $elapsed\n"
+    f"• Reason: Left within {BAN_DURATION_HOURS} hour of joining"
+)
+
+class BroadcastSession:
+    """One admin's in-progress broadcast collection.
+
+    Slotted: sessions are tiny fixed-shape records, so skipping the
+    per-instance dict keeps them to two references each.
+    """
+
+    __slots__ = ('messages', 'start_time')
+
+    def __init__(self):
+        self.messages = []
+        self.start_time = time.time()
+
+def mark_chat_active(chat_id):
+    """Record a chat for broadcasts, writing to disk only when new.
+
+    The mirror set already holds every known chat (loaded at startup), so
+    the common repeat case is one hash probe with no SQLite statement; an
+    exact set at int-per-chat cost beats a bloom filter here since the
+    full chat list is resident anyway.
+    """
+    if chat_id in active_chats:
+        return
+    active_chats.add(chat_id)
+    storage.add_chat(chat_id)
+    logger.info("Chat %s added to active chats", chat_id)
+
+async def _restore_state(app: Application):
+    """Load the active-chat mirror from storage"""
+    active_chats.update(storage.load_chats())
+    logger.info("Restored state: %s tracked users, %s active chats", storage.tracked_count(), len(active_chats))
+
+# Create application
+try:
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(ORJSONRequest(
+            connection_pool_size=CONNECTION_POOL_SIZE,
+            connect_timeout=5.0,
+            read_timeout=10.0,
+            pool_timeout=POOL_TIMEOUT
+        ))
+        # getUpdates long-polls on its own small pool so polling mode can
+        # never starve outbound sends; unused when updates come by webhook
+        .get_updates_request(ORJSONRequest(
+            connection_pool_size=GET_UPDATES_POOL_SIZE,
+            connect_timeout=5.0,
+            read_timeout=10.0,
+            pool_timeout=POOL_TIMEOUT
+        ))
+        .concurrent_updates(CONCURRENT_UPDATES)
+        # Token-bucket pacing on every outbound call: ~30/s overall and
+        # 20/min per group, so bursts queue client-side instead of eating
+        # a 429 plus retry_after pause
+        .rate_limiter(AIORateLimiter(max_retries=1))
+        .post_init(_restore_state)
+        .build()
+    )
+    logger.info("✅ Bot application created successfully")
+except Exception as e:
+    logger.error("❌ Failed to create bot application: %s", e)
+    exit(1)
+
+# Caps concurrent broadcast deliveries; one shared gate for all broadcasts
+SEM = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+# copy_messages takes at most 100 message ids per call
+COPY_BATCH_SIZE = 100
+
+# Broadcast deliveries get a few tries before counting as failed
+MAX_SEND_ATTEMPTS = 3
+
+# Edit the admin's status message every this many completed chats
+PROGRESS_EVERY = 50
+
+async def _copy_batch(bot, chat_id, batch_kwargs):
+    """Copy one message batch, honouring rate limits and transient failures.
+
+    RetryAfter carries Telegram's own cooldown; network hiccups (TimedOut
+    is a NetworkError subclass) back off exponentially. The last attempt
+    propagates so the caller counts the chat as failed.
+    """
+    for attempt in range(MAX_SEND_ATTEMPTS):
+        try:
+            await bot.copy_messages(chat_id=chat_id, **batch_kwargs)
+            return
+        except RetryAfter as e:
+            if attempt == MAX_SEND_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(e.retry_after)
+        except NetworkError:
+            if attempt == MAX_SEND_ATTEMPTS - 1:
+                raise
+            await asyncio.sleep(2 ** attempt)
+
+# Cached per-chat "can the bot ban here" answers so the leave path can
+# short-circuit without a round trip; entries expire so promotions and
+# demotions of the bot are picked up within CAN_BAN_TTL seconds
+CAN_BAN_TTL = 300.0
+_can_ban_cache = {}  # chat_id -> (bool, expiry)
+
+def _caption_suffix(message):
+    return f" with caption: {message.caption[:30]}..." if message.caption else ""
+
+# Preview builders for collected broadcast messages, scanned in order with
+# the first populated attribute winning; replaces the if/elif chain over
+# message types in the collect handler
+_PREVIEWERS = (
+    ('text', lambda m: f"📝 Text message: {m.text[:50]}{'...' if len(m.text) > 50 else ''}"),
+    ('photo', lambda m: "🖼️ Photo" + _caption_suffix(m)),
+    ('video', lambda m: "🎥 Video" + _caption_suffix(m)),
+    ('document', lambda m: "📎 Document" + _caption_suffix(m)),
+    ('sticker', lambda m: "😀 Sticker")
+)
+
+def _preview(message):
+    """Build a one-line preview of a collected message, or None"""
+    for attr, build in _PREVIEWERS:
+        if getattr(message, attr):
+            return build(message)
+    return None
+
+async def can_ban(bot, chat_id):
+    """Whether the bot may ban members in this chat; cached with a TTL"""
+    cached = _can_ban_cache.get(chat_id)
+    if cached is not None and time.monotonic() < cached[1]:
+        return cached[0]
+
+    member = await bot.get_chat_member(chat_id, bot.id)
+    result = member.status == 'administrator' and bool(member.can_restrict_members)
+    _can_ban_cache[chat_id] = (result, time.monotonic() + CAN_BAN_TTL)
+    return result
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command"""
+    try:
+        user = update.effective_user
+        chat = update.effective_chat
+
+        if chat:
+            mark_chat_active(chat.id)
+
+        await update.message.reply_text(WELCOME_TEMPLATE.format(name=user.first_name))
+        logger.info("Start command from user %s in chat %s", user.id, chat.id if chat else 'unknown')
+    except Exception as e:
+        logger.error("Error in start command: %s", e)
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /help command"""
+    try:
+        await update.message.reply_text(HELP_TEXT)
     except Exception as e:
-        logger.error(f"Error in help command: {e}")
+        logger.error("Error in help command: %s", e)
 
-def stats(update: Update, context: CallbackContext):
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /stats command"""
     try:
         user = update.effective_user
-        
+
         # Check if user is admin
         if user.id not in ADMIN_IDS:
-            update.message.reply_text("❌ You are not authorized to use this command.")
-            logger.warning(f"Unauthorized stats access attempt by user {user.id}")
+            await update.message.reply_text("❌ You are not authorized to use this command.")
+            logger.warning("Unauthorized stats access attempt by user %s", user.id)
             return
-        
+
         stats_text = (
             f"📊 Bot Statistics:\n\n"
-            f"• 👥 Tracked users: {len(user_join_times)}\n"
+            f"• 👥 Tracked users: {storage.tracked_count()}\n"
             f"• 💬 Active chats: {len(active_chats)}\n"
             f"• 📢 Active broadcasts: {len(broadcast_data)}\n"
             f"• 🚫 Ban duration: {BAN_DURATION_HOURS} hour(s)\n"
             f"• 👑 Admins: {len(ADMIN_IDS)}"
         )
-        update.message.reply_text(stats_text)
-        logger.info(f"Stats command executed by admin {user.id}")
+        await update.message.reply_text(stats_text)
+        logger.info("Stats command executed by admin %s", user.id)
     except Exception as e:
-        logger.error(f"Error in stats command: {e}")
+        logger.error("Error in stats command: %s", e)
+
+# Membership transitions, resolved once so the routing tests in
+# on_chat_member are single C-level frozenset lookups
+_JOIN_OLD = frozenset({'left', 'kicked', 'restricted'})
+_JOIN_NEW = frozenset({'member', 'administrator', 'creator'})
+_LEAVE_OLD = frozenset({'member', 'administrator', 'restricted'})
+_LEAVE_NEW = frozenset({'left', 'kicked'})
+
+async def on_chat_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Route a chat_member update to the join or leave path"""
+    cm = update.chat_member
+    if not cm:
+        return
 
-def track_user_join(update: Update, context: CallbackContext):
+    # Walk each TelegramObject attribute chain exactly once; the
+    # trackers get the extracted objects instead of re-deriving them
+    new = cm.new_chat_member
+    old_status = cm.old_chat_member.status
+    new_status = new.status
+
+    if old_status in _JOIN_OLD and new_status in _JOIN_NEW:
+        await track_user_join(cm.chat, new.user, context)
+    elif old_status in _LEAVE_OLD and new_status in _LEAVE_NEW:
+        await track_user_leave(cm.chat, new.user, context)
+
+async def track_user_join(chat, user, context: ContextTypes.DEFAULT_TYPE):
     """Track when users join the chat"""
     try:
-        if update.chat_member:
-            chat = update.chat_member.chat
-            user = update.chat_member.new_chat_member.user
-            old_status = update.chat_member.old_chat_member.status
-            new_status = update.chat_member.new_chat_member.status
-            
-            # User joined the chat
-            if (old_status in ['left', 'kicked', 'restricted'] and 
-                new_status in ['member', 'administrator', 'creator']):
-                
-                user_key = f"{chat.id}_{user.id}"
-                user_join_times[user_key] = {
-                    'join_time': datetime.now(),
-                    'user_id': user.id,
-                    'chat_id': chat.id,
-                    'username': user.username or user.first_name,
-                    'chat_title': chat.title or 'Unknown Chat'
-                }
-                active_chats.add(chat.id)
-                
-                logger.info(f"User {user.id} (@{user.username}) joined chat {chat.id} ({chat.title}) at {datetime.now()}")
-                
+        # Bot accounts (including this bot entering a new group) never
+        # need a ban timer; still mark the chat so broadcasts reach it
+        if user.is_bot:
+            mark_chat_active(chat.id)
+            return
+
+        storage.record_join(
+            chat.id,
+            user.id,
+            time.time(),
+            user.username or user.first_name,
+            chat.title or 'Unknown Chat'
+        )
+        mark_chat_active(chat.id)
+
+        logger.info("User %s (@%s) joined chat %s (%s)", user.id, user.username, chat.id, chat.title)
+
     except Exception as e:
-        logger.error(f"Error tracking user join: {e}")
+        logger.error("Error tracking user join: %s", e)
 
-def track_user_leave(update: Update, context: CallbackContext):
+async def track_user_leave(chat, user, context: ContextTypes.DEFAULT_TYPE):
     """Track when users leave and ban if within 1 hour"""
     try:
-        if update.chat_member:
-            chat = update.chat_member.chat
-            user = update.chat_member.new_chat_member.user
-            old_status = update.chat_member.old_chat_member.status
-            new_status = update.chat_member.new_chat_member.status
-            
-            # User left or was kicked
-            if (old_status in ['member', 'administrator', 'restricted'] and 
-                new_status in ['left', 'kicked']):
-                
-                user_key = f"{chat.id}_{user.id}"
-                user_data = user_join_times.get(user_key)
-                
-                if user_data:
-                    join_time = user_data['join_time']
-                    time_in_chat = datetime.now() - join_time
-                    
-                    # Check if user left within the ban duration
-                    if time_in_chat < timedelta(hours=BAN_DURATION_HOURS):
-                        try:
-                            # Ban the user
-                            context.bot.ban_chat_member(
-                                chat_id=chat.id,
-                                user_id=user.id
-                            )
-                            
-                            # Send ban notification
-                            ban_message = (
-                                f"🚫 User Banned\n\n"
-                                f"• User: @{user.username or user.first_name}\n"
-                                f"• Joined: {join_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                                f"• Time in chat: {str(time_in_chat).split('.')[0]}\n"
-                                f"• Reason: Left within {BAN_DURATION_HOURS} hour of joining"
-                            )
-                            
-                            context.bot.send_message(
-                                chat_id=chat.id,
-                                text=ban_message
-                            )
-                            
-                            logger.info(f"Banned user {user.id} for leaving within {BAN_DURATION_HOURS} hour of joining")
-                            
-                        except Exception as ban_error:
-                            logger.error(f"Failed to ban user {user.id}: {ban_error}")
-                            # Try to send error message
-                            try:
-                                context.bot.send_message(
-                                    chat_id=chat.id,
-                                    text=f"❌ Could not ban user @{user.username or user.first_name}. Make sure I have admin permissions."
-                                )
-                            except:
-                                pass
-                    
-                    # Remove user from tracking regardless of ban
-                    user_join_times.pop(user_key, None)
-                    logger.info(f"User {user.id} left chat {chat.id}, removed from tracking")
-                    
+        row = storage.pop_join(chat.id, user.id)
+
+        if row is not None:
+            joined_at, username = row
+            elapsed = time.time() - joined_at
+
+            # Check if user left within the ban duration; skip the
+            # doomed ban call when we already know the bot lacks
+            # ban rights in this chat
+            if elapsed < BAN_DURATION_SECONDS and await can_ban(context.bot, chat.id):
+                try:
+                    # Ban the user
+                    await context.bot.ban_chat_member(
+                        chat_id=chat.id,
+                        user_id=user.id
+                    )
+
+                    # Send ban notification
+                    ban_message = BAN_TMPL.substitute(
+                        user=username,
+                        joined=datetime.fromtimestamp(joined_at).strftime('%Y-%m-%d %H:%M:%S'),
+                        elapsed=timedelta(seconds=int(elapsed))
+                    )
+
+                    # Fire-and-forget so the notification round-trip never
+                    # blocks leave processing during a mass-leave burst;
+                    # PTB's task registry picks up any send failure
+                    context.application.create_task(context.bot.send_message(
+                        chat_id=chat.id,
+                        text=ban_message
+                    ))
+
+                    logger.info("Banned user %s for leaving within %s hour of joining", user.id, BAN_DURATION_HOURS)
+
+                except Exception as ban_error:
+                    logger.error("Failed to ban user %s: %s", user.id, ban_error)
+                    context.application.create_task(context.bot.send_message(
+                        chat_id=chat.id,
+                        text=f"❌ Could not ban user @{username}. Make sure I have admin permissions."
+                    ))
+
+            if logger.isEnabledFor(logging.INFO):
+                logger.info("User %s left chat %s, removed from tracking", user.id, chat.id)
+
+    except Exception as e:
+        logger.error("Error tracking user leave: %s", e)
+
+async def cleanup_joins(context: ContextTypes.DEFAULT_TYPE):
+    """Evict join entries too old to ever trigger a ban"""
+    try:
+        cutoff = time.time() - BAN_DURATION_SECONDS
+        removed = storage.evict_stale(cutoff)
+
+        # Hard cap as a second line of defence: even inside the ban
+        # window, a join flood may not keep more than MAX_TRACKED_JOINS
+        # rows; the oldest (least ban-relevant) go first
+        removed += storage.evict_over_cap(MAX_TRACKED_JOINS)
+
+        if removed:
+            logger.info("Evicted %s stale join entries, %s still tracked", removed, storage.tracked_count())
     except Exception as e:
-        logger.error(f"Error tracking user leave: {e}")
+        logger.error("Error cleaning up join tracking: %s", e)
 
 # Broadcast functionality
-def start_broadcast(update: Update, context: CallbackContext):
+async def start_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start broadcast message collection"""
     try:
         user = update.effective_user
-        
+
         # Check if user is admin
         if user.id not in ADMIN_IDS:
-            update.message.reply_text("❌ You are not authorized to use this command.")
+            await update.message.reply_text("❌ You are not authorized to use this command.")
             return
-        
+
         # Initialize broadcast data for this user
-        broadcast_data[user.id] = {
-            'messages': [],
-            'start_time': datetime.now()
-        }
-        
-        instructions = (
-            "📢 Broadcast Mode Started!\n\n"
-            "Now you can send me the messages you want to broadcast. I support:\n"
-            "• Text messages\n"
-            "• Photos with captions\n"
-            "• Videos with captions\n"
-            "• Documents with captions\n"
-            "• Stickers\n\n"
-            "Send your messages one by one. When you're done, use:\n"
-            "• /send_broadcast - To send all collected messages\n"
-            "• /cancel_broadcast - To cancel and clear all messages\n\n"
-            "Currently collected: 0 messages"
-        )
-        
-        update.message.reply_text(instructions)
-        logger.info(f"Broadcast mode started by admin {user.id}")
-        
+        broadcast_data[user.id] = BroadcastSession()
+        broadcast_collect_filter.add_user_ids(user.id)
+
+        await update.message.reply_text(BROADCAST_INSTRUCTIONS)
+        logger.info("Broadcast mode started by admin %s", user.id)
+
     except Exception as e:
-        logger.error(f"Error starting broadcast: {e}")
+        logger.error("Error starting broadcast: %s", e)
 
-def collect_broadcast_message(update: Update, context: CallbackContext):
+async def collect_broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Collect messages for broadcast"""
     try:
         user = update.effective_user
-        
+
         # Check if user is in broadcast mode
         if user.id not in broadcast_data:
             return
-        
+
         message = update.message
-        message_data = {
-            'message_id': message.message_id,
-            'date': message.date,
-            'chat_id': message.chat_id
-        }
-        
-        # Handle different message types
-        if message.text:
-            message_data.update({
-                'type': 'text',
-                'content': message.text
-            })
-            preview = f"📝 Text message: {message.text[:50]}{'...' if len(message.text) > 50 else ''}"
-            
-        elif message.photo:
-            message_data.update({
-                'type': 'photo',
-                'file_id': message.photo[-1].file_id,  # Highest quality photo
-                'caption': message.caption
-            })
-            preview = f"🖼️ Photo" + (f" with caption: {message.caption[:30]}..." if message.caption else "")
-            
-        elif message.video:
-            message_data.update({
-                'type': 'video',
-                'file_id': message.video.file_id,
-                'caption': message.caption
-            })
-            preview = f"🎥 Video" + (f" with caption: {message.caption[:30]}..." if message.caption else "")
-            
-        elif message.document:
-            message_data.update({
-                'type': 'document',
-                'file_id': message.document.file_id,
-                'caption': message.caption
-            })
-            preview = f"📎 Document" + (f" with caption: {message.caption[:30]}..." if message.caption else "")
-            
-        elif message.sticker:
-            message_data.update({
-                'type': 'sticker',
-                'file_id': message.sticker.file_id
-            })
-            preview = f"😀 Sticker"
-            
-        else:
-            update.message.reply_text("❌ Unsupported message type. Please send text, photo, video, document, or sticker.")
+
+        # Delivery copies the original message by reference, so only the
+        # preview needs the type inspection here
+        preview = _preview(message)
+        if preview is None:
+            await update.message.reply_text("❌ Unsupported message type. Please send text, photo, video, document, or sticker.")
             return
-        
-        # Add message to broadcast collection
-        broadcast_data[user.id]['messages'].append(message_data)
-        total_messages = len(broadcast_data[user.id]['messages'])
-        
+
+        # Only the source reference is stored; Telegram keeps the content
+        broadcast_data[user.id].messages.append((message.chat_id, message.message_id))
+        total_messages = len(broadcast_data[user.id].messages)
+
         # Send confirmation
         confirmation = (
             f"✅ {preview}\n\n"
@@ -317,168 +503,183 @@ def collect_broadcast_message(update: Update, context: CallbackContext):
             f"• /send_broadcast - To send to all chats\n"
             f"• /cancel_broadcast - To cancel"
         )
-        
-        update.message.reply_text(confirmation)
-        logger.info(f"Broadcast message collected by admin {user.id}, total: {total_messages}")
-        
+
+        await update.message.reply_text(confirmation)
+        logger.info("Broadcast message collected by admin %s, total: %s", user.id, total_messages)
+
     except Exception as e:
-        logger.error(f"Error collecting broadcast message: {e}")
+        logger.error("Error collecting broadcast message: %s", e)
 
-def send_broadcast(update: Update, context: CallbackContext):
+async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send broadcast to all active chats"""
     try:
         user = update.effective_user
-        
+
         # Check if user is admin
         if user.id not in ADMIN_IDS:
-            update.message.reply_text("❌ You are not authorized to use this command.")
+            await update.message.reply_text("❌ You are not authorized to use this command.")
             return
-        
+
         # Check if there are messages to broadcast
-        if user.id not in broadcast_data or not broadcast_data[user.id]['messages']:
-            update.message.reply_text("❌ No messages to broadcast. Use /broadcast first to start collecting messages.")
+        if user.id not in broadcast_data or not broadcast_data[user.id].messages:
+            await update.message.reply_text("❌ No messages to broadcast. Use /broadcast first to start collecting messages.")
             return
-        
-        update.message.reply_text("🔄 Starting broadcast... This may take a while depending on the number of chats.")
-        
-        messages = broadcast_data[user.id]['messages']
+
+        status_msg = await update.message.reply_text("🔄 Starting broadcast... This may take a while depending on the number of chats.")
+
+        messages = broadcast_data[user.id].messages
         chats = list(active_chats)
         total_chats = len(chats)
         total_messages = len(messages)
-        
+
         if not chats:
-            update.message.reply_text("❌ No active chats found for broadcasting.")
+            await update.message.reply_text("❌ No active chats found for broadcasting.")
             return
-        
+
+        # Batch consecutive messages from the same source chat so each
+        # destination needs ceil(M/100) copy_messages calls instead of M
+        # sends; Telegram copies the content server-side by reference
+        # ... and shape each batch's call kwargs once here, instead of
+        # rebuilding identical dicts for every destination chat
+        batches = []
+        batch_chat, batch_ids = None, []
+        for src_chat, msg_id in messages:
+            if src_chat != batch_chat or len(batch_ids) >= COPY_BATCH_SIZE:
+                if batch_ids:
+                    batches.append({'from_chat_id': batch_chat, 'message_ids': batch_ids})
+                batch_chat, batch_ids = src_chat, []
+            batch_ids.append(msg_id)
+        if batch_ids:
+            batches.append({'from_chat_id': batch_chat, 'message_ids': batch_ids})
+
+        # Deliver to all chats concurrently; the semaphore keeps the
+        # in-flight count under Telegram's bulk rate limit, and a slow
+        # chat no longer stalls the rest of the fan-out. The bot reference
+        # is resolved once here rather than per delivery
+        bot = context.bot
+
+        async def _send_one(chat_id):
+            async with SEM:
+                try:
+                    for batch_kwargs in batches:
+                        await _copy_batch(bot, chat_id, batch_kwargs)
+                except Exception as e:
+                    return chat_id, e
+            return chat_id, None
+
+        # Harvest deliveries as they land so the admin sees live progress;
+        # the status edit is throttled and fired off-path to avoid adding
+        # its own round-trip to the fan-out
+        tasks = [asyncio.ensure_future(_send_one(chat_id)) for chat_id in chats]
         success_count = 0
         fail_count = 0
-        
-        # Send to each chat
-        for chat_id in chats:
-            try:
-                # Send each message to this chat
-                for msg in messages:
-                    if msg['type'] == 'text':
-                        context.bot.send_message(
-                            chat_id=chat_id,
-                            text=msg['content']
-                        )
-                    elif msg['type'] == 'photo':
-                        context.bot.send_photo(
-                            chat_id=chat_id,
-                            photo=msg['file_id'],
-                            caption=msg.get('caption')
-                        )
-                    elif msg['type'] == 'video':
-                        context.bot.send_video(
-                            chat_id=chat_id,
-                            video=msg['file_id'],
-                            caption=msg.get('caption')
-                        )
-                    elif msg['type'] == 'document':
-                        context.bot.send_document(
-                            chat_id=chat_id,
-                            document=msg['file_id'],
-                            caption=msg.get('caption')
-                        )
-                    elif msg['type'] == 'sticker':
-                        context.bot.send_sticker(
-                            chat_id=chat_id,
-                            sticker=msg['file_id']
-                        )
-                
+        completed = 0
+        for future in asyncio.as_completed(tasks):
+            chat_id, error = await future
+            completed += 1
+            if error is None:
                 success_count += 1
-                logger.info(f"Broadcast sent to chat {chat_id} ({success_count}/{total_chats})")
-                
-            except Exception as e:
+            else:
                 fail_count += 1
-                logger.error(f"Failed to send broadcast to chat {chat_id}: {e}")
-        
-        # Clean up broadcast data
-        message_count = len(broadcast_data[user.id]['messages'])
+                logger.error("Failed to send broadcast to chat %s: %s", chat_id, error)
+
+            if completed % PROGRESS_EVERY == 0 and completed < total_chats:
+                context.application.create_task(status_msg.edit_text(
+                    f"🔄 Broadcasting... {completed}/{total_chats} chats done"
+                ))
+
+        # Clean up broadcast data; the counts for the report were cached
+        # before the fan-out, so nothing reads the session after this pop
         broadcast_data.pop(user.id, None)
-        
+        broadcast_collect_filter.remove_user_ids(user.id)
+
         # Send final report
         report = (
             f"📊 Broadcast Completed!\n\n"
             f"✅ Successful: {success_count} chats\n"
             f"❌ Failed: {fail_count} chats\n"
-            f"📝 Messages sent: {message_count} per chat\n"
-            f"📨 Total deliveries: {success_count * message_count}\n"
+            f"📝 Messages sent: {total_messages} per chat\n"
+            f"📨 Total deliveries: {success_count * total_messages}\n"
             f"⏱️ Active chats: {total_chats}"
         )
-        
-        update.message.reply_text(report)
-        logger.info(f"Broadcast completed by admin {user.id}. Success: {success_count}, Failed: {fail_count}")
-        
+
+        await update.message.reply_text(report)
+        logger.info("Broadcast completed by admin %s. Success: %s, Failed: %s", user.id, success_count, fail_count)
+
     except Exception as e:
-        logger.error(f"Error sending broadcast: {e}")
+        logger.error("Error sending broadcast: %s", e)
 
-def cancel_broadcast(update: Update, context: CallbackContext):
+async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the broadcast process"""
     try:
         user = update.effective_user
-        
+
         if user.id in broadcast_data:
-            message_count = len(broadcast_data[user.id]['messages'])
+            message_count = len(broadcast_data[user.id].messages)
             broadcast_data.pop(user.id)
-            
-            update.message.reply_text(
+            broadcast_collect_filter.remove_user_ids(user.id)
+
+            await update.message.reply_text(
                 f"❌ Broadcast cancelled.\n"
                 f"🗑️ {message_count} message(s) were not sent."
             )
-            logger.info(f"Broadcast cancelled by admin {user.id}, {message_count} messages discarded")
+            logger.info("Broadcast cancelled by admin %s, %s messages discarded", user.id, message_count)
         else:
-            update.message.reply_text("No active broadcast to cancel.")
-            
+            await update.message.reply_text("No active broadcast to cancel.")
+
     except Exception as e:
-        logger.error(f"Error cancelling broadcast: {e}")
+        logger.error("Error cancelling broadcast: %s", e)
 
-def error_handler(update: Update, context: CallbackContext):
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors in the telegram bot"""
-    logger.error(f"Exception while handling an update: {context.error}")
+    logger.error("Exception while handling an update: %s", context.error)
 
 # Setup all handlers
 def setup_handlers():
     """Setup all telegram bot handlers"""
     try:
         # Basic commands
-        dispatcher.add_handler(CommandHandler("start", start))
-        dispatcher.add_handler(CommandHandler("help", help_command))
-        dispatcher.add_handler(CommandHandler("stats", stats))
-        
+        application.add_handler(CommandHandler("start", start))
+        application.add_handler(CommandHandler("help", help_command))
+        application.add_handler(CommandHandler("stats", stats))
+
         # Broadcast commands
-        dispatcher.add_handler(CommandHandler("broadcast", start_broadcast))
-        dispatcher.add_handler(CommandHandler("send_broadcast", send_broadcast))
-        dispatcher.add_handler(CommandHandler("cancel_broadcast", cancel_broadcast))
-        
-        # Message handler for collecting broadcast messages (must be after command handlers)
-        dispatcher.add_handler(MessageHandler(
-            Filters.all & ~Filters.command,
+        application.add_handler(CommandHandler("broadcast", start_broadcast))
+        application.add_handler(CommandHandler("send_broadcast", send_broadcast))
+        application.add_handler(CommandHandler("cancel_broadcast", cancel_broadcast))
+
+        # Message handler for collecting broadcast messages (must be after
+        # command handlers); only fires for admins with an open broadcast
+        # session, messaging the bot privately
+        application.add_handler(MessageHandler(
+            broadcast_collect_filter & filters.ChatType.PRIVATE & ~filters.COMMAND,
             collect_broadcast_message
         ))
-        
-        # Chat member handlers for tracking joins/leaves
-        dispatcher.add_handler(ChatMemberHandler(track_user_join, ChatMemberHandler.CHAT_MEMBER))
-        dispatcher.add_handler(ChatMemberHandler(track_user_leave, ChatMemberHandler.CHAT_MEMBER))
-        
+
+        # Single chat member handler; routes joins/leaves by status delta
+        application.add_handler(ChatMemberHandler(on_chat_member, ChatMemberHandler.CHAT_MEMBER))
+
         # Error handler
-        dispatcher.add_error_handler(error_handler)
-        
+        application.add_error_handler(error_handler)
+
         logger.info("✅ All bot handlers setup successfully")
-        
+
     except Exception as e:
-        logger.error(f"❌ Failed to setup bot handlers: {e}")
+        logger.error("❌ Failed to setup bot handlers: %s", e)
 
 # Initialize the bot handlers
 setup_handlers()
 
-# For webhook mode, we need to make the updater available
+# Periodic sweep of the join-tracking dicts; without it, entries for users
+# who join and never leave would accumulate forever. Runs once the
+# application starts, in both webhook and polling mode
+application.job_queue.run_repeating(cleanup_joins, interval=600, first=60)
+
+# For webhook mode the ASGI app drives the application; polling is for testing
 def start_polling():
     """Start the bot in polling mode (for testing)"""
     logger.info("Starting bot in polling mode...")
-    updater.start_polling()
-    updater.idle()
+    application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
-    start_polling()
\ No newline at end of file
+    start_polling()
@@ -0,0 +1,79 @@
+import logging
+import os
+import sqlite3
+
+# SQLite keeps join tracking and the active-chat list crash-safe without
+# rewriting a whole pickle on every flush. WAL mode makes writes
+# append-only and keeps readers unblocked; every statement here touches a
+# single row through the primary key, so calls stay in the microsecond
+# range and are safe to run inline from async handlers
+DB_PATH = os.environ.get('BOT_DB_PATH', 'bot.db')
+
+logger = logging.getLogger(__name__)
+
+conn = None
+
+def connect(path=DB_PATH):
+    """Open (or create) the database; safe to call more than once"""
+    global conn
+    if conn is not None:
+        return conn
+
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS joins ('
+        ' chat_id INTEGER,'
+        ' user_id INTEGER,'
+        ' ts REAL,'
+        ' username TEXT,'
+        ' chat_title TEXT,'
+        ' PRIMARY KEY (chat_id, user_id)'
+        ')'
+    )
+    conn.execute('CREATE TABLE IF NOT EXISTS chats (chat_id INTEGER PRIMARY KEY)')
+    logger.info("Storage ready at %s", path)
+    return conn
+
+def record_join(chat_id, user_id, ts, username, chat_title):
+    """Insert or refresh a join record"""
+    conn.execute(
+        'INSERT OR REPLACE INTO joins VALUES (?, ?, ?, ?, ?)',
+        (chat_id, user_id, ts, username, chat_title)
+    )
+
+def pop_join(chat_id, user_id):
+    """Remove and return (ts, username) for a tracked user, or None"""
+    return conn.execute(
+        'DELETE FROM joins WHERE chat_id = ? AND user_id = ? RETURNING ts, username',
+        (chat_id, user_id)
+    ).fetchone()
+
+def evict_stale(cutoff):
+    """Delete join records older than cutoff; returns the count removed"""
+    return conn.execute('DELETE FROM joins WHERE ts < ?', (cutoff,)).rowcount
+
+def evict_over_cap(max_rows):
+    """Drop the oldest join records beyond max_rows; returns the count removed.
+
+    Entries near the cap are the longest-joined and therefore the least
+    likely to still matter for a ban, so oldest-first eviction loses the
+    least signal — the same policy an LRU would apply.
+    """
+    return conn.execute(
+        'DELETE FROM joins WHERE (chat_id, user_id) IN ('
+        ' SELECT chat_id, user_id FROM joins ORDER BY ts DESC LIMIT -1 OFFSET ?'
+        ')',
+        (max_rows,)
+    ).rowcount
+
+def tracked_count():
+    return conn.execute('SELECT COUNT(*) FROM joins').fetchone()[0]
+
+def add_chat(chat_id):
+    conn.execute('INSERT OR IGNORE INTO chats VALUES (?)', (chat_id,))
+
+def load_chats():
+    """Return the full active-chat set, for the in-memory mirror"""
+    return {row[0] for row in conn.execute('SELECT chat_id FROM chats')}